@@ -1,24 +1,28 @@
+import hashlib
 import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from textwrap import dedent
+from types import MappingProxyType
+from xml.sax.saxutils import escape
 
 from dotenv import load_dotenv
+import groq
 import streamlit as st
 from langchain_groq import ChatGroq
 from langchain_core.output_parsers import StrOutputParser
 
 # ----------------------------
-# Optional PDF export
+# One-time session setup
 # ----------------------------
-try:
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet
-    REPORTLAB_AVAILABLE = True
-except Exception:
-    REPORTLAB_AVAILABLE = False
-
-# Load environment variables
-load_dotenv()
+if "_booted" not in st.session_state:
+    # Load environment variables
+    load_dotenv()
+    st.session_state["_booted"] = True
 
 
 # ----------------------------
@@ -35,31 +39,237 @@ def get_llm():
     api_key = _get_api_key()
     if not api_key:
         raise RuntimeError("Missing GROQ API key. Set GROQ_API_KEY (or 'key') in your .env")
-    return ChatGroq(model="openai/gpt-oss-20b", groq_api_key=api_key)
+    # Retries are handled by the app's jittered backoff, so the SDK's own retries are disabled
+    return ChatGroq(model="openai/gpt-oss-20b", groq_api_key=api_key, max_retries=0)
+
+
+@st.cache_resource(show_spinner=False)
+def get_chain():
+    """Compose the LLM with a string output parser once and reuse it."""
+    return get_llm() | StrOutputParser()
+
+
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_TTL = 3600  # seconds
+
+
+class ResponseCache:
+    """Thread-safe prompt-hash -> response text cache with a size bound and expiry."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def get(self, prompt: str):
+        """Return the cached response for prompt, or None if missing or expired."""
+        key = self._key(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, text = entry
+            if time.monotonic() - stored_at > self._ttl:
+                del self._entries[key]
+                return None
+            return text
+
+    def put(self, prompt: str, text: str) -> None:
+        """Store a response, evicting the oldest entries beyond the size bound."""
+        key = self._key(prompt)
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), text)
+            # Dicts keep insertion order, so the first key is the oldest
+            while len(self._entries) > self._max_entries:
+                del self._entries[next(iter(self._entries))]
+
+
+@st.cache_resource(show_spinner=False)
+def get_response_cache() -> ResponseCache:
+    """Shared response cache that survives reruns and sessions."""
+    return ResponseCache()
 
 
-def call_llm(prompt: str) -> str:
-    """Call LLM with given prompt and return response text."""
-    llm = get_llm()
-    parser = StrOutputParser()
-    chain = llm | parser
-    return chain.invoke(prompt)
+# Transient Groq failures worth retrying; client errors such as bad requests are not
+RETRYABLE_LLM_ERRORS = (
+    TimeoutError,
+    groq.APITimeoutError,
+    groq.APIConnectionError,
+    groq.RateLimitError,
+    groq.InternalServerError,
+)
+LLM_RETRY_ATTEMPTS = 3
+
+
+def _retry_delay(attempt: int) -> float:
+    """Exponential backoff with a little jitter."""
+    return 0.5 * (2 ** attempt) + random.random() * 0.2
+
+
+def _invoke_with_retry(chain, prompt: str, attempts: int = LLM_RETRY_ATTEMPTS) -> str:
+    """Invoke the chain, retrying transient Groq errors with backoff."""
+    for attempt in range(attempts):
+        try:
+            return chain.invoke(prompt)
+        except RETRYABLE_LLM_ERRORS:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(_retry_delay(attempt))
+
+
+def call_llm(prompt: str, chain=None, cache=None) -> str:
+    """Call LLM with given prompt and return response text.
+
+    Worker threads have no Streamlit script context, so they must pass chain and cache in.
+    """
+    chain = chain if chain is not None else get_chain()
+    cache = cache if cache is not None else get_response_cache()
+    cached = cache.get(prompt)
+    if cached is not None:
+        return cached
+    text = _invoke_with_retry(chain, prompt)
+    cache.put(prompt, text)
+    return text
+
+
+def stream_llm(prompt: str, attempts: int = LLM_RETRY_ATTEMPTS):
+    """Stream LLM response text chunk by chunk as it is generated."""
+    cache = get_response_cache()
+    cached = cache.get(prompt)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    for attempt in range(attempts):
+        try:
+            for chunk in get_chain().stream(prompt):
+                chunks.append(chunk)
+                yield chunk
+            break
+        except RETRYABLE_LLM_ERRORS:
+            # Partial output has already been shown, so only retry before the first chunk
+            if chunks or attempt == attempts - 1:
+                raise
+            time.sleep(_retry_delay(attempt))
+    # Only complete responses are cached
+    cache.put(prompt, "".join(chunks))
+
+
+def call_llm_pair(first_prompt: str, second_prompt: str, chain=None, cache=None) -> tuple:
+    """Call LLM with two independent prompts concurrently and return both response texts."""
+    chain = chain if chain is not None else get_chain()
+    cache = cache if cache is not None else get_response_cache()
+    # Two sync invokes on short-lived threads; the shared client never sees a per-call event loop
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first, second = pool.map(lambda prompt: call_llm(prompt, chain, cache), (first_prompt, second_prompt))
+    return first, second
+
+
+@st.cache_resource(show_spinner=False)
+def get_executor() -> ThreadPoolExecutor:
+    """Shared worker pool for blocking LLM calls, so reruns keep serving the UI."""
+    return ThreadPoolExecutor(max_workers=4)
 
 
 # ----------------------------
-# Prompt Builders
+# Export helpers
 # ----------------------------
-def build_lesson_prompt(subject, topic, grade, duration,
-    learning_objectives, customization,
-    difficulty, language) -> str:
-    """Build prompt for lesson plan generation."""
-    difficulty_guidance = {
-        "Easy": "Use simple language, foundational explainers, and concrete everyday examples.",
-        "Medium": "Use balanced depth, some technical vocabulary, and 1–2 brief real-world examples.",
-        "Hard": "Use advanced terminology, deeper conceptual links, and include extension tasks for high achievers.",
-    }.get(difficulty, "Use balanced language and depth.")
+def _try_import_reportlab():
+    """Import reportlab PDF helpers on demand; return None if it is not installed."""
+    try:
+        from reportlab.platypus import SimpleDocTemplate, Paragraph
+        from reportlab.lib.styles import getSampleStyleSheet
+        return SimpleDocTemplate, Paragraph, getSampleStyleSheet
+    except Exception:
+        return None
+
+
+TEXT_EXPORT_FORMATS = MappingProxyType({
+    "Markdown": ("md", "text/markdown"),
+    "Text": ("txt", "text/plain"),
+})
+
 
-    prompt = f"""
+def _try_import_markdown_pdf():
+    """Import the Markdown -> HTML -> PDF converters on demand; return None if they are not installed."""
+    try:
+        import markdown
+        from xhtml2pdf import pisa
+        return markdown, pisa
+    except Exception:
+        return None
+
+
+def _inline_resources_only(uri: str, rel: str) -> str:
+    """xhtml2pdf link callback: allow inline data: URIs, never fetch files or URLs from the lesson."""
+    # Raw HTML in LLM output (steerable via the customization field) must not trigger server-side requests
+    return uri if uri.startswith("data:") else ""
+
+
+@st.cache_data(show_spinner=False)
+def render_pdf(md: str, _reportlab: tuple) -> bytes:
+    """Render lesson Markdown to PDF bytes.
+
+    _reportlab is the tuple from _try_import_reportlab (leading underscore: not hashed by st.cache_data).
+    markdown + xhtml2pdf are used when available.
+    """
+    converter = _try_import_markdown_pdf()
+    if converter is not None:
+        markdown, pisa = converter
+        try:
+            html = markdown.markdown(md, extensions=["tables"])
+            buffer = BytesIO()
+            result = pisa.CreatePDF(html, dest=buffer, encoding="utf-8",
+                                    link_callback=_inline_resources_only)
+            if not result.err:
+                return buffer.getvalue()
+        except Exception:
+            # Malformed HTML/CSS from the LLM can raise; the plain rendering below still works
+            pass
+
+    # Fallback: plain-text paragraphs without Markdown formatting
+    SimpleDocTemplate, Paragraph, getSampleStyleSheet = _reportlab
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer)
+    styles = getSampleStyleSheet()
+
+    # One Paragraph per blank-line block keeps layout linear in document length
+    story = [
+        Paragraph(escape(part).replace("\n", "<br/>"), styles["BodyText"])
+        for part in md.split("\n\n")
+        if part.strip()
+    ]
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+# ----------------------------
+# Prompt Builders
+# ----------------------------
+# Read-only so the shared mapping cannot be mutated between reruns
+DIFFICULTY_GUIDANCE = MappingProxyType({
+    "Easy": "Use simple language, foundational explainers, and concrete everyday examples.",
+    "Medium": "Use balanced depth, some technical vocabulary, and 1–2 brief real-world examples.",
+    "Hard": "Use advanced terminology, deeper conceptual links, and include extension tasks for high achievers.",
+})
+DEFAULT_DIFFICULTY_GUIDANCE = "Use balanced language and depth."
+
+# Output-format line of the lesson template; the combined prompt swaps in its tagged variant
+LESSON_OUTPUT_FORMAT = "Return ONLY Markdown (no code fences). Use headings, bullets, and tables where helpful."
+COMBINED_LESSON_OUTPUT_FORMAT = (
+    "Write the lesson plan as Markdown (no code fences) inside <LESSON>...</LESSON>. "
+    "Use headings, bullets, and tables where helpful."
+)
+
+# Prompt templates are dedented once at import; builders only fill in the fields
+LESSON_PROMPT_TEMPLATE = dedent("""
     You are an expert instructional designer and teacher. Create a detailed, classroom-ready LESSON PLAN.
 
     Constraints & format:
@@ -68,7 +278,7 @@ def build_lesson_prompt(subject, topic, grade, duration,
     - Total duration: {duration}
     - Difficulty level: {difficulty}. {difficulty_guidance}
     - The lesson must be fun, practical, and interactive.
-    - Return ONLY Markdown (no code fences). Use headings, bullets, and tables where helpful.
+    - {output_format}
 
     Required sections (use clear Markdown headings):
     1. Title & Overview (1–2 sentences)
@@ -86,13 +296,9 @@ def build_lesson_prompt(subject, topic, grade, duration,
     Topic: {topic}
     Learning Objectives: {learning_objectives}
     Customization request: {customization}
-    """
-    return dedent(prompt)
+    """)
 
-
-def build_quiz_prompt(lesson_plan_md, grade, language, difficulty, num_questions) -> str:
-    """Build prompt for quiz generation based on lesson plan."""
-    prompt = f"""
+QUIZ_PROMPT_TEMPLATE = dedent("""
     You are an assessment designer. Based ONLY on the lesson plan content below, create a quiz.
 
     - Number of questions: {num_questions}
@@ -109,8 +315,122 @@ def build_quiz_prompt(lesson_plan_md, grade, language, difficulty, num_questions
     {lesson_plan_md}
     ---
     LESSON PLAN END
+    """)
+
+COMBINED_QUIZ_TEMPLATE = dedent("""
+    After the lesson plan, also act as an assessment designer and create a quiz based ONLY on that lesson plan.
+
+    - Number of questions: {num_questions}
+    - Difficulty: {difficulty}
+    - Grade/Level: {grade}
+    - Language: {language}
+    - Mix question types: multiple choice, short answer, and 1 challenge question.
+    - For multiple choice, include 4 options labeled A–D.
+    - Provide an **Answer Key** at the end under a collapsible details block.
+    - Write the quiz as clean Markdown (no code fences) inside <QUIZ>...</QUIZ>.
+
+    Output format: <LESSON>...lesson plan Markdown...</LESSON><QUIZ>...quiz Markdown...</QUIZ>
+    Do not write anything outside these tags.
+    """)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_lesson_prompt(subject, topic, grade, duration,
+    learning_objectives, customization,
+    difficulty, language, output_format=LESSON_OUTPUT_FORMAT) -> str:
+    """Build prompt for lesson plan generation."""
+    difficulty_guidance = DIFFICULTY_GUIDANCE.get(difficulty, DEFAULT_DIFFICULTY_GUIDANCE)
+    return LESSON_PROMPT_TEMPLATE.format_map(locals())
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_quiz_prompt(lesson_plan_md, grade, language, difficulty, num_questions) -> str:
+    """Build prompt for quiz generation based on lesson plan."""
+    return QUIZ_PROMPT_TEMPLATE.format_map(locals())
+
+
+# Overview and objectives frame the quiz; activities and assessment carry the lesson's facts
+QUIZ_CONTEXT_SECTIONS = ("overview", "learning objectives", "activities", "assessment")
+MARKDOWN_HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$", re.M)
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_quiz_context(lesson_plan_md: str) -> str:
+    """Reduce a lesson plan to the sections a quiz needs (overview, objectives, activities, assessment)."""
+    headings = list(MARKDOWN_HEADING_PATTERN.finditer(lesson_plan_md))
+    sections = []
+    covered_until = 0
+    for i, heading in enumerate(headings):
+        # Subsections of an already kept section are included with it
+        if heading.start() < covered_until:
+            continue
+        title = heading.group(2).lower()
+        if any(name in title for name in QUIZ_CONTEXT_SECTIONS):
+            # A section runs until the next heading of the same or a higher level
+            level = len(heading.group(1))
+            end = next(
+                (h.start() for h in headings[i + 1:] if len(h.group(1)) <= level),
+                len(lesson_plan_md),
+            )
+            sections.append(lesson_plan_md[heading.start():end].strip())
+            covered_until = end
+    # Unrecognised layout: fall back to the full lesson plan
+    return "\n\n".join(sections) if sections else lesson_plan_md
+
+
+def build_lesson_brief(subject, topic, learning_objectives) -> str:
+    """Build a short lesson description for quizzes generated alongside the lesson plan."""
+    return f"Subject: {subject}\nTopic: {topic}\nLearning Objectives: {learning_objectives}"
+
+
+@st.cache_data(show_spinner=False, max_entries=64)
+def build_combined_prompt(subject, topic, grade, duration,
+    learning_objectives, customization,
+    difficulty, language, num_questions) -> str:
+    """Build a single prompt that yields both the lesson plan and its quiz."""
+    lesson_prompt = build_lesson_prompt(subject, topic, grade, duration,
+                                        learning_objectives, customization,
+                                        difficulty, language, COMBINED_LESSON_OUTPUT_FORMAT)
+    return lesson_prompt + COMBINED_QUIZ_TEMPLATE.format_map(locals())
+
+
+COMBINED_PATTERN = re.compile(r"<LESSON>(.*?)</LESSON>.*<QUIZ>(.*?)</QUIZ>", re.S)
+
+
+def split_combined_output(text: str):
+    """Split a combined response into (lesson_md, quiz_md), or None if markers are missing."""
+    match = COMBINED_PATTERN.search(text)
+    if not match:
+        return None
+    return match.group(1).strip(), match.group(2).strip()
+
+
+def generate_lesson_and_quiz(chain, cache, combined_prompt: str, lesson_prompt: str, quiz_prompt: str) -> tuple:
+    """Generate lesson and quiz in one request, falling back to two concurrent requests.
+
+    Runs on a worker thread, so chain and cache are resolved by the caller.
     """
-    return dedent(prompt)
+    cached = cache.get(combined_prompt)
+    text = cached if cached is not None else _invoke_with_retry(chain, combined_prompt)
+    parsed = split_combined_output(text)
+    if parsed:
+        # Only cache combined output that splits; otherwise every retry would hit the fallback
+        if cached is None:
+            cache.put(combined_prompt, text)
+        return parsed
+    # Combined output could not be split: request lesson and a topic-based quiz concurrently
+    return call_llm_pair(lesson_prompt, quiz_prompt, chain, cache)
+
+
+def stream_to_state(key: str, prompt: str) -> None:
+    """Stream LLM output into a temporary placeholder and store the final text in session state."""
+    # The display block below renders the stored text, so the placeholder is cleared afterwards
+    placeholder = st.empty()
+    try:
+        with placeholder.container():
+            st.session_state[key] = st.write_stream(stream_llm(prompt))
+    finally:
+        placeholder.empty()
 
 
 # ----------------------------
@@ -135,63 +455,116 @@ with st.sidebar:
             "- Choose the **difficulty level**.\n"
             "- Adjust the number of **quiz questions**.\n"
             "- Click **Generate Lesson Plan**.\n"
-            "- Use **Download buttons** to save (Markdown, TXT, PDF).\n"
+            "- Pick a **Format** (Markdown or Text) and click **Download Lesson**.\n"
+            "- For a PDF, click **Prepare PDF**, then **Download Lesson (PDF)**.\n"
             "- Press **Reset** to start fresh."
         )
 
 
 # ----------------------------
-# Inputs
+# Inputs & Lesson Plan Generator
 # ----------------------------
-col1, col2 = st.columns(2)
-
-with col1:
-    subject = st.text_input("Subject", value=("Science" if use_example else ""))
-    topic = st.text_input("Topic", value=("The Solar System" if use_example else ""))
-    grade = st.text_input("Grade / Level", value=("5" if use_example else ""))
-    duration = st.text_input("Duration", value=("1 hour" if use_example else ""))
-
-with col2:
-    learning_objectives = st.text_area(
-        "Learning Objectives (measurable outcomes)",
-        value=(
-            "Students will be able to list the eight planets, describe their order from the sun, "
-            "and compare two planets by size and composition." if use_example else ""
-        ),
-        height=120,
-    )
-    customization = st.text_area(
-        "Customization (tone, activities, classroom context)",
-        value=("Make it fun and interactive with a quick game and a hands-on mini-model activity." if use_example else ""),
-        height=120,
-    )
+# Inputs live in a form so typing does not rerun the script until Generate is clicked
+with st.form("lesson_inputs"):
+    col1, col2 = st.columns(2)
+
+    with col1:
+        subject = st.text_input("Subject", value=("Science" if use_example else ""))
+        topic = st.text_input("Topic", value=("The Solar System" if use_example else ""))
+        grade = st.text_input("Grade / Level", value=("5" if use_example else ""))
+        duration = st.text_input("Duration", value=("1 hour" if use_example else ""))
+
+    with col2:
+        learning_objectives = st.text_area(
+            "Learning Objectives (measurable outcomes)",
+            value=(
+                "Students will be able to list the eight planets, describe their order from the sun, "
+                "and compare two planets by size and composition." if use_example else ""
+            ),
+            height=120,
+        )
+        customization = st.text_area(
+            "Customization (tone, activities, classroom context)",
+            value=("Make it fun and interactive with a quick game and a hands-on mini-model activity." if use_example else ""),
+            height=120,
+        )
 
+    with_quiz = st.checkbox("Also generate quiz now", value=False,
+                            help="Create the lesson plan and quiz in a single request")
+    submitted = st.form_submit_button("✨ Generate Lesson Plan", type="primary")
 
-# ----------------------------
-# Lesson Plan Generator
-# ----------------------------
-generate = st.button("✨ Generate Lesson Plan", type="primary")
-
-if generate:
+if submitted:
+    # A new submission supersedes any pending background job, so its result cannot overwrite newer output
+    pending = st.session_state.pop("_fut", None)
+    if pending is not None:
+        pending.cancel()
     if not all([subject, topic, grade, duration, learning_objectives]):
         st.warning("⚠️ Please fill out Subject, Topic, Grade, Duration, and Learning Objectives.")
     else:
-        with st.spinner("Generating lesson plan…"):
-            try:
-                prompt = build_lesson_prompt(subject, topic, grade, duration,
-                                             learning_objectives, customization,
-                                             difficulty, language)
-                lesson_md = call_llm(prompt)
-                st.session_state["lesson_md"] = lesson_md
-                st.session_state.pop("quiz_md", None)  
-            except Exception as e:
-                st.error(f"LLM error: {e}")
+        try:
+            prompt = build_lesson_prompt(subject, topic, grade, duration,
+                                         learning_objectives, customization,
+                                         difficulty, language)
+            if with_quiz:
+                combined_prompt = build_combined_prompt(subject, topic, grade, duration,
+                                                        learning_objectives, customization,
+                                                        difficulty, language, num_questions)
+                quiz_prompt = build_quiz_prompt(
+                    build_lesson_brief(subject, topic, learning_objectives),
+                    grade, language, difficulty, num_questions
+                )
+                # Resolve Streamlit-cached resources here: the worker thread has no script context,
+                # and a missing API key surfaces immediately instead of inside the future
+                st.session_state["_fut"] = get_executor().submit(
+                    generate_lesson_and_quiz, get_chain(), get_response_cache(),
+                    combined_prompt, prompt, quiz_prompt
+                )
+            else:
+                stream_to_state("lesson_md", prompt)
+                # The old quiz belongs to the replaced lesson; drop it only once the new lesson is stored
+                st.session_state.pop("quiz_md", None)
+        except Exception as e:
+            st.error(f"LLM error: {e}")
+
+
+# ----------------------------
+# Background generation
+# ----------------------------
+# Collect a finished job before the display renders, so its results show in this run
+if "_fut" in st.session_state and st.session_state["_fut"].done():
+    try:
+        st.session_state["lesson_md"], st.session_state["quiz_md"] = st.session_state.pop("_fut").result()
+    except Exception as e:
+        st.error(f"LLM error: {e}")
+
+
+@st.fragment(run_every=0.5)
+def _poll_generation():
+    """Show progress for the pending job; only this fragment reruns until the job finishes."""
+    fut = st.session_state.get("_fut")
+    if fut is None:
+        return
+    if fut.done():
+        # One full rerun picks up the results above
+        st.rerun(scope="app")
+    st.info("⏳ Generating lesson plan and quiz…")
+    if st.button("Cancel generation"):
+        # A running request cannot be interrupted; its result is simply discarded
+        fut.cancel()
+        st.session_state.pop("_fut", None)
+        st.rerun(scope="app")
+
+
+if "_fut" in st.session_state:
+    _poll_generation()
 
 
 # ----------------------------
 # Display Lesson Plan & Actions
 # ----------------------------
-if "lesson_md" in st.session_state:
+@st.fragment
+def _display():
+    """Render the lesson, quiz and export actions; widgets here rerun only this fragment."""
     st.subheader("📘 Lesson Plan")
     st.markdown(st.session_state["lesson_md"])
 
@@ -200,15 +573,13 @@ if "lesson_md" in st.session_state:
     st.subheader("🧠 Quiz Generator")
 
     if st.button("Create Quiz from this Lesson"):
-        with st.spinner("Generating quiz…"):
-            try:
-                quiz_prompt = build_quiz_prompt(
-                    st.session_state["lesson_md"], grade, language, difficulty, num_questions
-                )
-                quiz_md = call_llm(quiz_prompt)
-                st.session_state["quiz_md"] = quiz_md
-            except Exception as e:
-                st.error(f"LLM error: {e}")
+        try:
+            quiz_prompt = build_quiz_prompt(
+                build_quiz_context(st.session_state["lesson_md"]), grade, language, difficulty, num_questions
+            )
+            stream_to_state("quiz_md", quiz_prompt)
+        except Exception as e:
+            st.error(f"LLM error: {e}")
 
     if "quiz_md" in st.session_state:
         st.markdown("### 📝 Quiz")
@@ -218,40 +589,43 @@ if "lesson_md" in st.session_state:
     st.divider()
     st.subheader("📥 Export")
 
-    # Download Markdown
+    # Download Markdown or TXT (same bytes, different file name and MIME type)
     md_bytes = st.session_state["lesson_md"].encode("utf-8")
-    st.download_button("Download Lesson (Markdown)", data=md_bytes,
-                       file_name="lesson_plan.md", mime="text/markdown")
-
-    # Download TXT
-    txt_bytes = st.session_state["lesson_md"].encode("utf-8")
-    st.download_button("Download Lesson (TXT)", data=txt_bytes,
-                       file_name="lesson_plan.txt", mime="text/plain")
-
-    # Download PDF (if available)
-    if REPORTLAB_AVAILABLE:
-        try:
-            buffer = BytesIO()
-            doc = SimpleDocTemplate(buffer)
-            styles = getSampleStyleSheet()
-            story = []
-
-            # Convert Markdown newlines into Paragraph-friendly format
-            text = st.session_state["lesson_md"].replace("\n\n", "<br/><br/>").replace("\n", "<br/>")
-            story.append(Paragraph(text, styles["BodyText"]))
-            story.append(Spacer(1, 12))
-
-            doc.build(story)
-            buffer.seek(0)
-
-            st.download_button("Download Lesson (PDF)", data=buffer,
-                               file_name="lesson_plan.pdf", mime="application/pdf")
-        except Exception as e:
-            st.info("⚠️ PDF export encountered an issue. You can still download Markdown/TXT.")
-            st.caption(f"Details: {e}")
+    fmt = st.radio("Format", list(TEXT_EXPORT_FORMATS), horizontal=True)
+    ext, mime = TEXT_EXPORT_FORMATS[fmt]
+    st.download_button("Download Lesson", data=md_bytes,
+                       file_name=f"lesson_plan.{ext}", mime=mime)
+
+    # Download PDF (reportlab is only imported once the user asks for a PDF).
+    # The prepared lesson is remembered so the download button survives later reruns.
+    lesson_md = st.session_state["lesson_md"]
+    if st.session_state.get("_pdf_for") != lesson_md and st.button("Prepare PDF"):
+        st.session_state["_pdf_for"] = lesson_md
+    if st.session_state.get("_pdf_for") == lesson_md:
+        if "_rl" not in st.session_state:
+            st.session_state["_rl"] = _try_import_reportlab()
+        reportlab = st.session_state["_rl"]
+        if reportlab is None:
+            st.info("⚠️ PDF export needs reportlab (`pip install reportlab`). You can still download Markdown/TXT.")
+        else:
+            try:
+                # Cached by lesson text, so later reruns on the same lesson skip the rebuild
+                pdf_bytes = render_pdf(lesson_md, reportlab)
+                st.download_button("Download Lesson (PDF)", data=pdf_bytes,
+                                   file_name="lesson_plan.pdf", mime="application/pdf")
+            except Exception as e:
+                st.info("⚠️ PDF export encountered an issue. You can still download Markdown/TXT.")
+                st.caption(f"Details: {e}")
 
     # Reset Button (only after output exists)
     st.divider()
     if st.button("🔄 Reset for New Work"):
-        st.session_state.clear()
-        st.rerun()
+        # Only drop generated work (and any pending job); one-time setup flags and cached imports are kept
+        for key in ("lesson_md", "quiz_md", "_fut", "_pdf_for"):
+            st.session_state.pop(key, None)
+        # Full app rerun so the page drops the fragment entirely
+        st.rerun(scope="app")
+
+
+if "lesson_md" in st.session_state:
+    _display()